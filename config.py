@@ -1,14 +1,21 @@
 # Output format: 'flac' or 'wav'
 OUTPUT_FORMAT = "flac"
 
+# Logging level: "DEBUG" also logs each recording start, "WARNING" only logs fallbacks and failures
+LOG_LEVEL = "INFO"
+
 # Storage paths
 NETWORK_PATH = "/mnt/smbhome/audio_in/"
 BACKUP_PATH = "./backup_audio/"
+NETWORK_CHECK_INTERVAL = 10  # seconds between checks that NETWORK_PATH is reachable
+NETWORK_CHECK_TIMEOUT = 2  # seconds before a hung check counts as unreachable
 
 # Audio settings
 SAMPLE_RATE = 16000
 FRAME_DURATION = 30  # in milliseconds
 SILENCE_DURATION_BEFORE_SAVE = 3  # seconds
 TRAILING_SILENCE_TO_KEEP = 0.1  # seconds
+VAD_SAMPLE_RATE = 8000  # rate frames are decimated to before WebRTC VAD; must divide SAMPLE_RATE (8000, 16000, 32000 or 48000)
 VAD_SENSITIVITY = 3  # set aggressiveness mode. 0 is the least aggressive about filtering out non-speech, 3 is the most aggressive.
 MINIMUM_CONSECUTIVE_SPEECH_FRAMES = 7
+VAD_SKIP_AFTER_SILENCE_FRAMES = 5  # after this many silent frames in a recording, run VAD on every other frame only
@@ -1,17 +1,35 @@
 # main.py
 import pyaudio
-import wave
 import soundfile as sf
 import numpy as np
+import io
 import webrtcvad
 import logging
-from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
 import config
 
 
-# Suppress unnecessary log messages
-logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger("audio_recorder")
+
+
+def setup_logging() -> QueueListener:
+    """
+    Sends log records through a queue to a background thread that writes them
+    to stderr, so logging never blocks frame processing on a slow pipe or journal.
+    Returns the started listener; stop it to flush remaining records.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    logging.basicConfig(level=config.LOG_LEVEL, handlers=[QueueHandler(log_queue)])
+    listener.start()
+    return listener
+
 
 def suppress_pyaudio_logs():
     """
@@ -33,14 +51,67 @@ class AudioRecorder:
         self.frame_duration = config.FRAME_DURATION  # in milliseconds
         self.frame_size = int(self.sample_rate * self.frame_duration / 1000)
         self.vad = webrtcvad.Vad(config.VAD_SENSITIVITY)
+
+        # WebRTC VAD sees every n-th sample of each frame; recordings keep the full sample rate.
+        # Decimated frames are copied into a fixed array that VAD reads through a byte view.
+        self.vad_sample_rate = config.VAD_SAMPLE_RATE
+        if (self.vad_sample_rate not in (8000, 16000, 32000, 48000)
+                or self.sample_rate % self.vad_sample_rate != 0):
+            raise ValueError(
+                f"VAD_SAMPLE_RATE must be 8000, 16000, 32000 or 48000 and divide "
+                f"SAMPLE_RATE ({self.sample_rate}), got {self.vad_sample_rate}"
+            )
+        self._vad_decimation = self.sample_rate // self.vad_sample_rate
+        self._vad_frame = np.empty(self.frame_size // self._vad_decimation, dtype=np.int16)
+        self._vad_frame_bytes = memoryview(self._vad_frame).cast('B')
+
         self.recording = False
-        self.buffer = []
+
+        # Single worker that writes recordings, so file I/O never holds up frame processing
+        self._io_pool = ThreadPoolExecutor(max_workers=1)
+
+        # PortAudio, the microphone's device index and the input stream, opened on first use
+        self._audio = None
+        self._device_index = None
+        self._stream = None
+
+        # Alternates during long silences so only every other frame is run through VAD
+        self._vad_skip = 0
+        self.vad_skip_after_silence_frames = config.VAD_SKIP_AFTER_SILENCE_FRAMES
+
+        # Frames captured by the PortAudio callback, waiting to be processed
+        self._frame_queue = queue.SimpleQueue()
+
+        # Recording being encoded in memory, owned by the I/O thread. The encoded
+        # data grows with the length of the recording until it is saved.
+        self._encoded = None
+        self._sf = None
+        self._recording_filename = None
+
+        # The most recent speech frames seen before recording starts
+        self.speech_pre_buffer = deque(maxlen=config.MINIMUM_CONSECUTIVE_SPEECH_FRAMES)
 
         # Number of silent frames allowed before saving
         self.silence_threshold = int(
             (config.SILENCE_DURATION_BEFORE_SAVE * 1000) / self.frame_duration
         )
+
+        # The last MINIMUM_CONSECUTIVE_SPEECH_FRAMES VAD decisions, newest in the lowest bit
+        # (1 = speech). Recording starts once they are all set. The oldest bit is masked off
+        # before shifting, so the value never exceeds the start mask; with up to 8 frames it
+        # stays within CPython's small-int cache and updating it allocates nothing.
+        self._vad_bits = 0
+        self._start_mask = (1 << config.MINIMUM_CONSECUTIVE_SPEECH_FRAMES) - 1
+        self._shift_mask = self._start_mask >> 1
+
+        # Silence frames held back from the file until we know whether speech resumes.
+        # Recording stops once silence_threshold of them have accumulated.
         self.silence_counter = 0
+        self._silence_frames = []
+
+        # Frames waiting to be handed to the I/O thread as one task, about once a second
+        self._write_batch = []
+        self.write_batch_frames = int(1000 / self.frame_duration)
 
         # Number of silence frames to keep at the end of the recording
         self.trailing_silence_frames = int(
@@ -54,9 +125,40 @@ class AudioRecorder:
         if not os.path.exists(self.backup_path):
             os.makedirs(self.backup_path)
 
+        # Network path availability, refreshed in the background so saves never stat the share.
+        # Treated as down until the first check completes.
+        self._network_up = False
+        self._network_checker = None
+        threading.Thread(target=self._monitor_network_path, daemon=True).start()
+
         # Flag to indicate if any speech was detected during a recording session
         self.speech_detected_in_recording = False
 
+    def _monitor_network_path(self):
+        """
+        Periodically checks whether the network path is reachable and caches the result.
+        """
+        while True:
+            self._network_up = self._network_path_reachable()
+            time.sleep(config.NETWORK_CHECK_INTERVAL)
+
+    def _network_path_reachable(self) -> bool:
+        """
+        Checks for the network directory on a throwaway thread, so a hung
+        SMB mount counts as unreachable after config.NETWORK_CHECK_TIMEOUT.
+        While an earlier check is still hung, no new one is started.
+        """
+        if self._network_checker is not None and self._network_checker.is_alive():
+            return False
+
+        result = []
+        self._network_checker = threading.Thread(
+            target=lambda: result.append(os.path.isdir(self.network_path)), daemon=True
+        )
+        self._network_checker.start()
+        self._network_checker.join(config.NETWORK_CHECK_TIMEOUT)
+        return bool(result and result[0])
+
     def _get_blue_snowball_device_index(self, audio_obj: pyaudio.PyAudio) -> int:
         """
         Finds and returns the device index of the 'Blue Snowball' microphone.
@@ -73,149 +175,304 @@ class AudioRecorder:
         Continuously reads audio frames from the microphone and detects speech.
         Once 5 consecutive speech frames are detected, recording starts.
         Pre-buffer ensures initial speech frames are included.
+
+        Capture runs in PortAudio's callback thread, which only queues frames;
+        VAD and buffering happen here, so a slow iteration delays processing
+        without dropping audio.
         """
-        audio = pyaudio.PyAudio()
+        stream = self._open_stream()
+        if stream.is_stopped():
+            stream.start_stream()
+
+        logger.info("Listening for speech... Press Ctrl+C to stop.")
+
+        try:
+            while True:
+                frame = self._frame_queue.get()
+                if self._skip_vad():
+                    self._process_frame(frame, False)  # Reuse the previous (silent) decision
+                else:
+                    self._process_frame(frame, self._is_speech(frame))
+
+        except KeyboardInterrupt:
+            logger.info("Recording stopped by user")
+            if self.recording:
+                self.save_recording()
+                self.recording = False
+                self.silence_counter = 0
+                self.speech_detected_in_recording = False
+        finally:
+            stream.stop_stream()
+            self._reset_listening_state()
+
+    def _reset_listening_state(self):
+        """
+        Discards frames captured before the stream stopped and the VAD history
+        built from them, so the next record() call starts from fresh audio.
+        """
+        while True:
+            try:
+                self._frame_queue.get_nowait()
+            except queue.Empty:
+                break
+        self._vad_bits = 0
+        self._vad_skip = 0
+        self.speech_pre_buffer.clear()
+
+    def _open_stream(self):
+        """
+        Returns the input stream from the microphone, creating PortAudio and
+        the stream on first use. Both stay open until close() is called.
+        """
+        if self._stream is not None:
+            return self._stream
+
+        if self._audio is None:
+            self._audio = pyaudio.PyAudio()
         try:
-            device_index = self._get_blue_snowball_device_index(audio)
+            if self._device_index is None:
+                self._device_index = self._get_blue_snowball_device_index(self._audio)
         except Exception as e:
-            audio.terminate()
+            self._audio.terminate()
+            self._audio = None
             raise e
 
-        stream = audio.open(
+        self._stream = self._audio.open(
             format=pyaudio.paInt16,
             channels=1,
             rate=self.sample_rate,
             input=True,
-            input_device_index=device_index,
-            frames_per_buffer=self.frame_size
+            input_device_index=self._device_index,
+            frames_per_buffer=self.frame_size,
+            stream_callback=self._on_audio_frame
         )
+        return self._stream
 
-        print("Listening for speech... Press Ctrl+C to stop.")
+    def close(self):
+        """
+        Closes the input stream and PortAudio, and waits for queued writes and saves to finish.
+        """
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+        self._io_pool.shutdown(wait=True)
+
+    def _on_audio_frame(self, in_data: bytes, frame_count: int, time_info: dict, status: int):
+        """
+        PortAudio stream callback. Hands the captured frame over to record() and returns immediately.
+        """
+        self._frame_queue.put(in_data)
+        return None, pyaudio.paContinue
 
-        self.speech_frame_counter = 0  # Track consecutive speech frames
-        self.speech_pre_buffer = []  # Store speech frames before recording starts
+    def _skip_vad(self) -> bool:
+        """
+        Once a recording has been silent for more than vad_skip_after_silence_frames frames,
+        returns True for every other frame so VAD runs at half rate until speech resumes.
+        """
+        if not self.recording or self.silence_counter <= self.vad_skip_after_silence_frames:
+            self._vad_skip = 0
+            return False
+        self._vad_skip ^= 1
+        return bool(self._vad_skip)
 
+    def _is_speech(self, frame: bytes) -> bool:
+        """
+        Runs WebRTC VAD on a single frame, decimated to vad_sample_rate.
+        """
         try:
-            while True:
-                frame = stream.read(self.frame_size, exception_on_overflow=False)
-
-                is_speech = False
-                try:
-                    is_speech = self.vad.is_speech(frame, self.sample_rate)
-                except Exception:
-                    pass  # If VAD fails, treat as non-speech
-
-                if is_speech:
-                    self.speech_detected_in_recording = True
-                    self.silence_counter = 0
-                    self.speech_frame_counter += 1  # Count consecutive speech frames
-
-                    # Always store speech frames in the pre-buffer
-                    self.speech_pre_buffer.append(frame)
-
-                    # Only start recording if we get 5 consecutive speech frames
-                    if not self.recording and self.speech_frame_counter >= config.MINIMUM_CONSECUTIVE_SPEECH_FRAMES:
-                        print("Speech confirmed, recording started")
-                        self.recording = True
-                        self.buffer = self.speech_pre_buffer[:]  # Include pre-buffer
-                        self.speech_pre_buffer = []  # Clear pre-buffer
-
-                    if self.recording:
-                        self.buffer.append(frame)
-
-                else:  # No speech detected
-                    self.speech_frame_counter = 0  # Reset speech frame counter
-                    if not self.recording:
-                        self.speech_pre_buffer = []  # Discard old pre-buffer on silence
-
-                    if self.recording:
-                        self.silence_counter += 1
-                        self.buffer.append(frame)
-
-                        # Stop recording after prolonged silence
-                        if self.silence_counter >= self.silence_threshold:
-                            if self.speech_detected_in_recording:
-                                self.save_recording()
-                            self.recording = False
-                            self.buffer = []
-                            self.silence_counter = 0
-                            self.speech_detected_in_recording = False
+            if self._vad_decimation > 1:
+                self._vad_frame[:] = np.frombuffer(frame, dtype=np.int16)[::self._vad_decimation]
+                frame = self._vad_frame_bytes
+            return self.vad.is_speech(frame, self.vad_sample_rate)
+        except Exception:
+            return False  # If VAD fails, treat as non-speech
 
-        except KeyboardInterrupt:
-            print("Recording stopped by user")
-            if self.recording and self.buffer and self.speech_detected_in_recording:
+    def _process_frame(self, frame: bytes, is_speech: bool):
+        """
+        Advances the recording state machine by one frame.
+        """
+        self._vad_bits = ((self._vad_bits & self._shift_mask) << 1) | is_speech
+
+        if is_speech:
+            self.speech_detected_in_recording = True
+
+            if self.recording:
+                self._flush_silence(self.silence_counter)  # The silence was a pause, so keep it
+                self._queue_write((frame,))
+            else:
+                # Store speech frames in the pre-buffer until speech is confirmed
+                self.speech_pre_buffer.append(frame)
+
+                # Only start recording if we get enough consecutive speech frames
+                if self._vad_bits & self._start_mask == self._start_mask:
+                    logger.debug("Speech confirmed, recording started")
+                    self.recording = True
+                    self._start_recording()
+
+            self.silence_counter = 0
+
+        elif self.recording:  # No speech detected
+            self._silence_frames.append(frame)
+            self.silence_counter += 1
+
+            # Stop recording after prolonged silence
+            if self.silence_counter >= self.silence_threshold:
                 self.save_recording()
-        finally:
-            stream.stop_stream()
-            stream.close()
-            audio.terminate()
+                self.recording = False
+                self.silence_counter = 0
+                self.speech_detected_in_recording = False
+
+    def _start_recording(self):
+        """
+        Starts a new recording and writes the pre-buffered speech frames to it, oldest first.
+        """
+        self._recording_filename = (
+            f"recording_{time.strftime('%Y%m%d_%H%M%S')}.{config.OUTPUT_FORMAT}"
+        )
+        self._submit_io(self._open_recording)
+
+        # The start condition guarantees the pre-buffer holds exactly the confirming speech frames
+        self._queue_write(tuple(self.speech_pre_buffer))
+        self.speech_pre_buffer.clear()
+
+    def _flush_silence(self, count: int):
+        """
+        Writes the first `count` held-back silence frames to the recording and
+        discards the rest.
+        """
+        if count:
+            self._queue_write(tuple(self._silence_frames[:count]))
+        self._silence_frames.clear()
+
+    def _queue_write(self, frames: tuple):
+        """
+        Adds frames to the next batch to be appended to the recording, handing
+        the batch to the I/O thread once it holds write_batch_frames frames.
+        """
+        self._write_batch.extend(frames)
+        if len(self._write_batch) >= self.write_batch_frames:
+            self._submit_writes()
+
+    def _submit_writes(self):
+        """
+        Hands the current batch of frames to the I/O thread to be appended to the recording.
+        """
+        if self._write_batch:
+            self._submit_io(self._write_to_recording, self._write_batch)
+            self._write_batch = []
 
     def save_recording(self):
         """
-        Saves the current buffer of audio frames to disk, first trying
-        the network path, then falling back to the backup path if there's an error.
+        Writes the trailing silence to keep, then queues the recording to be
+        finished and saved. Recordings without speech are discarded.
         """
-        if len(self.buffer) <= 1:
-            return
+        self._flush_silence(min(self.silence_counter, self.trailing_silence_frames))
+        self._submit_writes()
+        self._submit_io(
+            self._finish_recording, self._recording_filename, self.speech_detected_in_recording
+        )
 
-        # Trim trailing silence if needed
-        if self.silence_counter > self.trailing_silence_frames:
-            trim_frames = self.silence_counter - self.trailing_silence_frames
-            self.buffer = self.buffer[:-trim_frames]
+    def _submit_io(self, fn, *args):
+        """
+        Queues a task on the I/O thread, logging any exception it raises.
+        """
+        self._io_pool.submit(fn, *args).add_done_callback(self._log_io_error)
+
+    def _log_io_error(self, future):
+        """
+        Logs the exception raised by a finished I/O task, if any.
+        """
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Recording I/O task failed: %s", future.exception())
+
+    def _open_recording(self):
+        """
+        Starts encoding a new recording, in the format specified by config.OUTPUT_FORMAT,
+        into an in-memory buffer. Runs on the I/O thread.
+        """
+        try:
+            self._encoded = io.BytesIO()
+            self._sf = sf.SoundFile(
+                self._encoded, mode='w', samplerate=self.sample_rate,
+                channels=1, subtype='PCM_16', format=config.OUTPUT_FORMAT.upper()
+            )
+        except Exception as e:
+            self._sf = None
+            self._encoded = None
+            logger.error("Failed to start recording: %s", e)
+
+    def _write_to_recording(self, frames: list):
+        """
+        Appends frames to the recording being encoded, passing each one to
+        soundfile as an int16 view of its bytes. If a write fails the
+        recording is discarded. Runs on the I/O thread.
+        """
+        if self._sf is None:
+            return
+        try:
+            for frame in frames:
+                self._sf.write(np.frombuffer(frame, dtype=np.int16))
+        except Exception as e:
+            logger.error("Failed to write recording, discarding it: %s", e)
+            try:
+                self._sf.close()
+            except Exception:
+                pass  # The encoder is already broken; the recording is discarded anyway
+            self._sf = None
+            self._encoded = None
 
-        # Construct filename
-        filename = f"recording_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{config.OUTPUT_FORMAT}"
-        audio_data = np.frombuffer(b''.join(self.buffer), dtype=np.int16)
+    def _finish_recording(self, filename: str, keep: bool):
+        """
+        Finishes encoding the recording and writes it out in a single write,
+        first trying the network path, then falling back to the backup path
+        if there's an error. Runs on the I/O thread.
+        """
+        if self._sf is None:
+            return  # Opening or writing the recording failed and was logged
+        self._sf.close()
+        data = self._encoded.getbuffer()
+        self._sf = None
+        self._encoded = None
+
+        if not keep:
+            return
 
         # Attempt to save to the network drive
         network_file_path = os.path.join(self.network_path, filename)
         try:
-            if not os.path.exists(self.network_path):
+            if not self._network_up:
                 raise FileNotFoundError(
-                    f"Network directory {self.network_path} does not exist"
+                    f"Network directory {self.network_path} is not reachable"
                 )
-            self._write_audio_file(audio_data, network_file_path)
-            print(f"Saved recording to network drive: {network_file_path}")
+            self._write_file(data, network_file_path)
+            logger.info("Saved recording to network drive: %s", network_file_path)
 
         # Fallback to the backup path
         except Exception:
             backup_file_path = os.path.join(self.backup_path, filename)
             try:
-                self._write_audio_file(audio_data, backup_file_path)
-                print(f"Saved recording to backup location: {backup_file_path}")
+                self._write_file(data, backup_file_path)
+                logger.warning("Saved recording to backup location: %s", backup_file_path)
             except Exception as e:
-                print(f"Failed to save recording: {str(e)}")
-
-    def _write_audio_file(self, audio_data: np.ndarray, filepath: str):
-        """
-        Writes the audio data to a file in the format specified by config.OUTPUT_FORMAT.
-        """
-        if config.OUTPUT_FORMAT.lower() == "wav":
-            self._save_to_wave_file(audio_data, filepath)
-        else:
-            self._save_to_flac_file(audio_data, filepath)
-
-    def _save_to_wave_file(self, audio_data: np.ndarray, filepath: str):
-        """
-        Saves audio data in WAV format.
-        """
-        with wave.open(filepath, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)  # 16-bit audio
-            wf.setframerate(self.sample_rate)
-            wf.writeframes(audio_data.tobytes())
+                logger.error("Failed to save recording: %s", e)
 
-    def _save_to_flac_file(self, audio_data: np.ndarray, filepath: str):
+    def _write_file(self, data: memoryview, filepath: str):
         """
-        Saves audio data in FLAC format using the soundfile library.
+        Writes an encoded recording to a new file in large sequential writes.
+        The buffered file retries short writes until all the data is written.
         """
-        with sf.SoundFile(
-            filepath, mode='x', samplerate=self.sample_rate,
-            channels=1, subtype='PCM_16', format="FLAC"
-        ) as sf_file:
-            sf_file.write(audio_data)
+        with open(filepath, 'xb', buffering=1 << 20) as f:
+            f.write(data)
 
 
 if __name__ == "__main__":
+    log_listener = setup_logging()
     recorder = AudioRecorder()
-    recorder.record()
+    try:
+        recorder.record()
+    finally:
+        recorder.close()
+        log_listener.stop()